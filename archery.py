@@ -6,8 +6,20 @@
 # date: December 2019
 
 import os
+import sys
+import time
+import logging
+import json
+import struct
+import weakref
 import pygame
 import random
+try:
+    from pygame._sdl2 import sdl2, video
+    RENDERER_ERRORS = pygame.error, sdl2.error
+except ImportError:
+    # pygame 1 has no renderer, only the software display surface is used
+    video = None
 from collections import namedtuple
 from abc import ABC, abstractmethod
 
@@ -28,6 +40,8 @@ SCORE_TABLE = [3, 2, 1]
 # game 'physics'
 GRAVITY = 3
 
+LOGGER = logging.getLogger('archery')
+
 
 class GameObject(pygame.sprite.Sprite):
     '''
@@ -88,19 +102,9 @@ class GameObject(pygame.sprite.Sprite):
         Not to be called before pygame image modulea has been initialized.
         '''
         try:
-            IMGS = []
-            for surface in cls.IMGS:
-                colorkey = surface.get_at((0, 0))
-                surface.set_colorkey(colorkey)
-                surface = surface.convert()
-                IMGS.append(surface)
-            cls.IMGS = IMGS
+            cls.IMGS = [blit_format(surface) for surface in cls.IMGS]
         except AttributeError:
-            surface = cls.IMG
-            colorkey = surface.get_at((0, 0))
-            surface.set_colorkey(colorkey)
-            surface = surface.convert()
-            cls.IMG = surface
+            cls.IMG = blit_format(cls.IMG)
 
 
 class Bow(GameObject):
@@ -126,6 +130,8 @@ class Bow(GameObject):
     TIME_COOLDOWN_S = 1
     # class attribute keeping track of the only instance of the class
     INSTANCE = pygame.sprite.GroupSingle()
+    # snapshot layout: x, y, speed x, speed y, ammo, state, bent time, cooldown
+    SNAPSHOT = struct.Struct('<hhhhBBhh')
 
     def __init__(self, context):
         '''
@@ -160,22 +166,55 @@ class Bow(GameObject):
         self._arrow(self._context, topleft, self.force)
         self._ammo -= 1
 
+    def snapshot(self):
+        '''
+        Return the bow's state packed as described by Bow.SNAPSHOT.
+        '''
+        return Bow.SNAPSHOT.pack(self._rect.x, self._rect.y,
+                                 self._speed[0], self._speed[1],
+                                 self._ammo,
+                                 BOW_STATES.index(type(self._state)),
+                                 getattr(self, '_bent_time', 0),
+                                 getattr(self, '_cooldown', 0))
+
+    def restore(self, data, offset=0):
+        '''
+        Set the bow's state back to the one packed in data at offset by
+        snapshot.
+        '''
+        x, y, speed_x, speed_y, self._ammo, state, self._bent_time, \
+            self._cooldown = Bow.SNAPSHOT.unpack_from(data, offset)
+        self._rect.topleft = x, y
+        self._speed = [speed_x, speed_y]
+        self._state = BOW_STATES[state].restored(self)
+
     def draw(self, step):
         '''
-        Redraw a bow's _img, only to be called when the bow's state changes.
+        Change a bow's _img, only to be called when the bow's state changes.
         '''
-        self._img = Bow.IMG.copy()
-        overlay = pygame.Surface(self._img.get_size())
+        self._img = Bow.FRAMES[step]
+
+    @classmethod
+    def render_frame(cls, step):
+        '''
+        Return the picture of a bow whose rope is bent to step, -1 being the
+        rope without any arrow.
+        '''
+        img = cls.IMG.copy()
+        overlay = pygame.Surface(img.get_size())
         if step == -1:
-            pygame.draw.line(overlay, COLOR_ROPE, Bow.ROPE_TOP, Bow.ROPE_BOT)
+            pygame.draw.line(overlay, COLOR_ROPE, cls.ROPE_TOP, cls.ROPE_BOT)
         else:
-            base_x = Bow.ROPE_TOP[0]
-            x = base_x * (1 - step / Bow.ROPE_STATES)
-            pygame.draw.line(overlay, COLOR_ROPE, Bow.ROPE_TOP, (x, Bow.ROPE_MIDDLE))
-            pygame.draw.line(overlay, COLOR_ROPE, Bow.ROPE_BOT, (x, Bow.ROPE_MIDDLE))
+            base_x = cls.ROPE_TOP[0]
+            x = base_x * (1 - step / cls.ROPE_STATES)
+            pygame.draw.line(overlay, COLOR_ROPE, cls.ROPE_TOP, (x, cls.ROPE_MIDDLE))
+            pygame.draw.line(overlay, COLOR_ROPE, cls.ROPE_BOT, (x, cls.ROPE_MIDDLE))
             overlay.blit(Arrow.IMGS[Arrow.SHOT], (x - base_x, 0))
         overlay.set_colorkey(overlay.get_at((0, 0)))
-        self._img.blit(overlay, (0, 0))
+        img.blit(overlay, (0, 0))
+        # run-length encode the new picture again
+        img.set_colorkey(cls.IMG.get_colorkey(), pygame.RLEACCEL)
+        return img
 
     @property
     def force(self):
@@ -188,13 +227,17 @@ class Bow(GameObject):
     def init(cls, fps):
         '''
         Initialize the picture that represents an instance of Bow onscreen. 
-        Also initialize class constants related to time depending on fps rate.
-        Not to be called before pygame image module has been initialized.
+        Also initialize class constants related to time depending on fps rate,
+        and the pictures of the bow for every step of its rope, in FRAMES.
+        Not to be called before pygame image module has been initialized and
+        Arrow has been initialized.
         '''
         super().init()
         cls.TIME_COOLDOWN_FPS = int(cls.TIME_COOLDOWN_S * fps)
         cls.TIME_FORCE_FPS = int(cls.TIME_FORCE_S * fps)
         cls.ROPE_MIDDLE = ((cls.ROPE_BOT[1] - cls.ROPE_TOP[1]) // 2) + cls.ROPE_TOP[1]
+        last_step = cls.TIME_FORCE_FPS // (cls.TIME_FORCE_FPS // cls.ROPE_STATES)
+        cls.FRAMES = {step: cls.render_frame(step) for step in range(-1, last_step+1)}
 
 
 class NormalBowState:
@@ -206,10 +249,16 @@ class NormalBowState:
         self._master.draw(0)
 
     def update(self, inputs):
-        for an_input in inputs:
-            if an_input.type == pygame.KEYDOWN:
-                if an_input.key == pygame.K_SPACE:
-                    self._master._state = BentBowState(self._master)
+        if pygame.K_SPACE in inputs.pressed:
+            self._master._state = BentBowState(self._master)
+
+    @classmethod
+    def restored(cls, master):
+        '''
+        Return the state for a master whose attributes have just been restored
+        from a snapshot, only its picture needs to be redrawn.
+        '''
+        return cls(master)
 
 
 class BentBowState:
@@ -221,20 +270,26 @@ class BentBowState:
         self._master = master
         self._master._bent_time = 0
 
+    @classmethod
+    def restored(cls, master):
+        ''' Return the state without resetting master's _bent_time. '''
+        state = cls.__new__(cls)
+        state._master = master
+        master.draw(master._bent_time // (Bow.TIME_FORCE_FPS // Bow.ROPE_STATES))
+        return state
+
     def update(self, inputs):
         if self._master._bent_time < Bow.TIME_FORCE_FPS:
             self._master._bent_time += 1
             step = self._master._bent_time / (Bow.TIME_FORCE_FPS // Bow.ROPE_STATES)
             if step.is_integer():
                 self._master.draw(step)
-        for an_input in inputs:
-            if an_input.type == pygame.KEYUP:
-                if an_input.key == pygame.K_SPACE:
-                    self._master.shoot()
-                    if self._master._ammo:
-                        self._master._state = ReloadBowState(self._master)
-                    else:
-                        self._master._state = EmptyBowState(self._master)
+        if pygame.K_SPACE in inputs.released:
+            self._master.shoot()
+            if self._master._ammo:
+                self._master._state = ReloadBowState(self._master)
+            else:
+                self._master._state = EmptyBowState(self._master)
 
 
 class ReloadBowState:
@@ -252,6 +307,14 @@ class ReloadBowState:
         if self._master._cooldown == 0:
             self._master._state = NormalBowState(self._master)
 
+    @classmethod
+    def restored(cls, master):
+        ''' Return the state without resetting master's _cooldown. '''
+        state = cls.__new__(cls)
+        state._master = master
+        master.draw(-1)
+        return state
+
 
 class EmptyBowState:
     '''
@@ -266,6 +329,15 @@ class EmptyBowState:
     def update(self, inputs):
         pass
 
+    @classmethod
+    def restored(cls, master):
+        ''' Return the state, entering it has no side effect to avoid. '''
+        return cls(master)
+
+
+# every state a bow can be in, indexed as in Bow.SNAPSHOT
+BOW_STATES = [NormalBowState, BentBowState, ReloadBowState, EmptyBowState]
+
 
 class Arrow(GameObject):
     '''
@@ -283,6 +355,8 @@ class Arrow(GameObject):
     INSTANCES = pygame.sprite.Group()
     HITBOX_OFFSET = (165, 90)
     HITBOX_SIZE = (26, 17)
+    # snapshot layout: x, y, speed x (a float shot force), speed y
+    SNAPSHOT = struct.Struct('<hhdh')
 
     def __init__(self, context, topleft, force):
         '''
@@ -305,16 +379,42 @@ class Arrow(GameObject):
         '''
         if self._speed != [0, 0]:
             self._speed[1] += GRAVITY
-            self._rect.move_ip(self._speed)
-            self._hitbox.move_ip(self._speed)
-            if self._rect.x > SCREEN_WIDTH or self._rect.y > SCREEN_HEIGHT:
-                super().kill()
-            zone = self._hitbox.collidelist(self._target.hitbox)
+            # sweep the hitbox along this frame's motion so that fast arrows
+            # can't go through a zone between two frames
+            zone, fraction = swept_collide(self._hitbox,
+                                           self._speed,
+                                           self._target.hitbox)
             if zone != -1:
+                # stop the arrow where it hit the target
+                impact = [round(fraction * speed) for speed in self._speed]
+                self._rect.move_ip(impact)
+                self._hitbox.move_ip(impact)
                 self._speed = [0, 0]
                 self._img = Arrow.IMGS[Arrow.STOPPED]
                 self._context.update_score(zone, self)
                 super().kill()
+                return
+            self._rect.move_ip(self._speed)
+            self._hitbox.move_ip(self._speed)
+            if self._rect.x > SCREEN_WIDTH or self._rect.y > SCREEN_HEIGHT:
+                super().kill()
+
+    def snapshot(self):
+        '''
+        Return the arrow's state packed as described by Arrow.SNAPSHOT.
+        '''
+        return Arrow.SNAPSHOT.pack(self._rect.x, self._rect.y, *self._speed)
+
+    @classmethod
+    def restore(cls, context, data, offset=0):
+        '''
+        Create an arrow back from the state packed in data at offset by
+        snapshot.
+        '''
+        x, y, speed_x, speed_y = cls.SNAPSHOT.unpack_from(data, offset)
+        arrow = cls(context, (x, y), speed_x)
+        arrow._speed[1] = speed_y
+        return arrow
 
     def __del__(self):
         print('deleted arrow')
@@ -390,8 +490,7 @@ class Target:
         Initialize picture that represent an instance of Target onscreen. Not to
         be called before pygame image module has been initialized.
         '''
-        cls.IMG = cls.IMG.convert()
-        cls.IMG.set_colorkey(cls.IMG.get_at((0, 0)))
+        cls.IMG = blit_format(cls.IMG)
 
 
 class Context(ABC):
@@ -402,18 +501,20 @@ class Context(ABC):
     def update(self, inputs):
         '''
         Every subclass needs to implement this. It is meant to handle inputs
-        from user and modify the Context's state accordingly.
+        from user, an InputSnapshot, and modify the Context's state accordingly.
         '''
         pass
 
     @classmethod
-    def init(cls, screen):
+    def init(cls, screen, governor):
         '''
         Initialize the Context subclass. It sets the value for the class
-        attribute SCREEN which should be used to blit anything onscreen for the
-        user to see.
+        attribute SCREEN, a Screen which should be used to blit anything
+        onscreen for the user to see, and for the class attribute GOVERNOR, the FrameGovernor
+        telling how much work can be done every frame.
         '''
         cls.SCREEN = screen
+        cls.GOVERNOR = governor
 
 
 class GameContext(Context):
@@ -424,54 +525,140 @@ class GameContext(Context):
                        the whole game.
         - _score: the score
         - _score_font: the font used to write out the score onscreen
+        - _score_render: the score last written out and its rendered surface
+        - _stuck: topleft positions of the arrows stuck in the target, in the
+                  order they were drawn on the background
     '''
+    # background prepared ahead of time for the next game
+    NEXT_BACKGROUND = None
+    # snapshot layout: score, arrows flying, arrows stuck, followed by the
+    # bow, every flying arrow and every stuck arrow's position
+    SNAPSHOT = struct.Struct('<iHH')
+    STUCK = struct.Struct('<hh')
+
     def __init__(self):
         '''
         Create GameContext object. During initialization, Bow and Target class
         are both instanciated.
         '''
-        self._background = draw_background((200, 240), 8)
+        if GameContext.NEXT_BACKGROUND:
+            self._background = GameContext.NEXT_BACKGROUND
+            GameContext.NEXT_BACKGROUND = None
+        else:
+            self._background = draw_background((200, 240), 8)
+        GameContext.GOVERNOR.defer(GameContext.preload)
         self._score = 0
         self._score_font = pygame.font.Font(FONT_NAME, 55)
+        self._score_render = None, None
         # Bow instanciation
         Bow(self)
         Target(self._background)
+        # the background before any arrow gets stuck in the target
+        self._clean_background = self._background.copy()
+        self._stuck = []
         self._drawn = False
 
     def update(self, inputs):
         if not self._drawn:
             GameContext.SCREEN.blit(self._background, (0, 0))
             self._drawn = True
-        # clean up previous position
-        for group in Bow.INSTANCE, Arrow.INSTANCES:
-            group.clear(GameContext.SCREEN, self._background)
+        # frames that won't be shown are not drawn either
+        render = GameContext.GOVERNOR.should_render()
         score_surf_pos = SCREEN_WIDTH//2, 0
-        GameContext.SCREEN.blit(self._background, score_surf_pos,
-                                pygame.Rect(score_surf_pos, self._score_font.size(str(self._score))))
+        if render:
+            # clean up previous position
+            for group in Bow.INSTANCE, Arrow.INSTANCES:
+                group.clear(GameContext.SCREEN, self._background)
+            GameContext.SCREEN.blit(self._background, score_surf_pos,
+                                    pygame.Rect(score_surf_pos, self._score_font.size(str(self._score))))
         # update bow and arrows
         Bow.INSTANCE.sprite.update(inputs)
         Arrow.INSTANCES.update()
-        # draw bow and arrows
-        for group in Bow.INSTANCE, Arrow.INSTANCES:
-            group.draw(GameContext.SCREEN)
-        # update score surface
-        score_surface = self._score_font.render(str(self._score), True, COLOR_FONT)
-        screen.blit(score_surface, score_surf_pos)
+        if render:
+            # draw bow and arrows
+            for group in Bow.INSTANCE, Arrow.INSTANCES:
+                group.draw(GameContext.SCREEN)
+            # update score surface
+            GameContext.SCREEN.blit(self.score_surface(), score_surf_pos)
         # hand control to another contex
-        for an_input in inputs:
-            if an_input.type == pygame.KEYDOWN:
-                if an_input.key == pygame.K_ESCAPE:
-                    self._drawn = False
-                    return 'Pause Switch'
+        if pygame.K_ESCAPE in inputs.pressed:
+            self._drawn = False
+            return 'Pause Switch'
+
+    def score_surface(self):
+        '''
+        Return the score written out, only rendered again when it changes.
+        '''
+        score, surface = self._score_render
+        if score != self._score:
+            surface = self._score_font.render(str(self._score), True, COLOR_FONT)
+            self._score_render = self._score, surface
+        return surface
 
     def update_score(self, zone, arrow):
         '''
         Update the context's score depending on the zone hit, draw the arrow
-        on the background and refresh the whole screen.
+        on the background and refresh the screen: all of it, or only the
+        arrow when the game is degraded to FrameGovernor.SKIP_REDRAWS.
         '''
         self._score += SCORE_TABLE[zone]
         iddle_sprite(arrow.image, arrow.rect, self._background)
-        GameContext.SCREEN.blit(self._background, (0, 0))
+        self._stuck.append(arrow.rect.topleft)
+        GameContext.SCREEN.invalidate(self._background)
+        if GameContext.GOVERNOR.level >= FrameGovernor.SKIP_REDRAWS:
+            # only the stuck arrow changed onscreen
+            GameContext.SCREEN.blit(self._background, arrow.rect, arrow.rect)
+        else:
+            GameContext.SCREEN.blit(self._background, (0, 0))
+
+    def snapshot(self):
+        '''
+        Return the whole game state as bytes, laid out as described by
+        GameContext.SNAPSHOT.
+        '''
+        arrows = Arrow.INSTANCES.sprites()
+        records = [GameContext.SNAPSHOT.pack(self._score, len(arrows), len(self._stuck)),
+                   Bow.INSTANCE.sprite.snapshot()]
+        records.extend(arrow.snapshot() for arrow in arrows)
+        records.extend(GameContext.STUCK.pack(*pos) for pos in self._stuck)
+        return b''.join(records)
+
+    def restore(self, data):
+        '''
+        Set the game back to the state returned by snapshot. The background
+        is only redrawn when the arrows stuck in it differ.
+        '''
+        self._score, n_arrows, n_stuck = GameContext.SNAPSHOT.unpack_from(data)
+        offset = GameContext.SNAPSHOT.size
+        Bow.INSTANCE.sprite.restore(data, offset)
+        offset += Bow.SNAPSHOT.size
+        Arrow.INSTANCES.empty()
+        for i in range(n_arrows):
+            Arrow.restore(self, data, offset)
+            offset += Arrow.SNAPSHOT.size
+        stuck = [GameContext.STUCK.unpack_from(data, offset + i * GameContext.STUCK.size)
+                 for i in range(n_stuck)]
+        if stuck[:len(self._stuck)] != self._stuck:
+            self._background = self._clean_background.copy()
+            self._stuck = []
+        for pos in stuck[len(self._stuck):]:
+            iddle_sprite(Arrow.IMGS[Arrow.STOPPED], pos, self._background)
+        GameContext.SCREEN.invalidate(self._background)
+        self._stuck = stuck
+        self._drawn = False
+
+    @classmethod
+    def preload(cls):
+        '''
+        Draw the background of the next game ahead of time.
+        '''
+        if not cls.NEXT_BACKGROUND:
+            cls.NEXT_BACKGROUND = draw_background((200, 240), 8)
+
+    @classmethod
+    def init(cls, screen, governor):
+        super().init(screen, governor)
+        governor.defer(cls.preload)
 
 
 
@@ -504,6 +691,8 @@ class CustomMenu(Context):
         background is a background image for the menu, if not provided the menu's
         representation onscreen will just be the render of its title, its
         options, a cursor, and a slightly opaque solid color as a background.
+        That translucent background is blended once over whatever is onscreen
+        when the menu gets drawn, the menu then only blits the opaque result.
         '''
         # initialize title, options and cursor position
         self._title = title
@@ -511,7 +700,8 @@ class CustomMenu(Context):
         self._cursor = 0
 
         # initialize background
-        self._background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        self._background = PixelFormat.convert(pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)))
+        self._overlay = None
         if background:
             bkgd_width, bkgd_height = background.get_size()
             x, y = 0, 0
@@ -520,11 +710,14 @@ class CustomMenu(Context):
                 y = (SCREEN_HEIGHT-bkgd_height) // 2
             self._background.blit(background, (x, y))
         else:
-            self._background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT),
-                                              flags=pygame.SRCALPHA)
-            pygame.draw.rect(self._background,
+            # translucent layer holding everything drawn by the menu, the
+            # opaque _background is made out of it in pre_blend
+            self._overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT),
+                                           flags=pygame.SRCALPHA)
+            self._overlay = PixelFormat.convert(self._overlay, translucent=True)
+            pygame.draw.rect(self._overlay,
                              CustomMenu.COLOR_DEFAULT,
-                             pygame.Rect((0, 0), self._background.get_size()))
+                             pygame.Rect((0, 0), self._overlay.get_size()))
 
         # initialize fonts
         bigfont_size, smallfont_size = font_sizes
@@ -552,20 +745,27 @@ class CustomMenu(Context):
     def update(self, inputs):
         # draw
         if not self._drawn:
+            if self._overlay:
+                self.pre_blend()
             CustomMenu.SCREEN.blit(self._background, (0, 0))
             self._drawn = True
             self.draw_cursor()
         # inputs
-        for an_input in inputs:
-            if an_input.type == pygame.KEYDOWN:
-                if an_input.key == pygame.K_DOWN:
-                    self.cursor += 1
-                elif an_input.key == pygame.K_UP:
-                    self.cursor -= 1
-                elif an_input.key == pygame.K_RETURN:
-                    self._drawn = False
-                    option = self._options[self._cursor]
-                    return option.instruction
+        if pygame.K_DOWN in inputs.pressed:
+            self.cursor += 1
+        if pygame.K_UP in inputs.pressed:
+            self.cursor -= 1
+        if pygame.K_RETURN in inputs.pressed:
+            self._drawn = False
+            option = self._options[self._cursor]
+            return option.instruction
+
+    def pre_blend(self):
+        '''
+        Blend the translucent overlay over what is currently onscreen into
+        _background, so that later redraws are plain opaque blits.
+        '''
+        self._background = CustomMenu.SCREEN.blend(self._overlay)
 
     def pos_i(self, i):
         x = 2 * SCREEN_WIDTH // 3
@@ -587,12 +787,13 @@ class CustomMenu(Context):
         x_pos, y_pos = self.pos_i(i)
         option_rect.x = x_pos
         option_rect.centery = y_pos
+        surface = self._overlay or self._background
         if self._opt_back and i != -1:
             x = option_rect.x - 2 * CustomMenu.MARGIN_SIZE - CustomMenu.CURSOR_SIZE
             y = option_rect.y - CustomMenu.MARGIN_SIZE // 4
-            self._background.blit(self._opt_back, (x, y))
-        self._background.blit(option_surf,
-                              option_rect)
+            surface.blit(self._opt_back, (x, y))
+        surface.blit(option_surf,
+                     option_rect)
 
     def cursor_rect(self):
         x_pos, y_pos = self.pos_i(self.cursor)
@@ -646,7 +847,7 @@ class CustomMenu(Context):
         opt_back = pygame.Surface((30, 20))
         pygame.draw.rect(opt_back, COLOR_FONT, 
                          opt_back.get_rect(), 1)
-        opt_back.convert()
+        opt_back = PixelFormat.convert(opt_back)
         return cls(title, option_dict, background=background, opt_back=opt_back)
 
     @classmethod
@@ -660,17 +861,547 @@ class CustomMenu(Context):
         opt_back = pygame.Surface((30, 20))
         pygame.draw.rect(opt_back, COLOR_FONT, 
                          opt_back.get_rect(), 1)
-        opt_back.convert()
+        opt_back = PixelFormat.convert(opt_back)
         return cls(title, option_dict, opt_back=opt_back)
 
     # class initializer
     @classmethod
-    def init(cls, screen):
-        super().init(screen)
+    def init(cls, screen, governor):
+        super().init(screen, governor)
+        # the cursor is the only sprite relying on per-pixel alpha
+        cls.IMG_CURSOR = blit_format(cls.IMG_CURSOR, translucent=True)
         cls.CURSOR_SIZE = CustomMenu.IMG_CURSOR.get_size()[0]
         cls.MARGIN_SIZE = 15
 
 
+# keys pressed and released since last frame, keys currently held down and
+# whether the user asked to close the window, keys are sets of pygame key codes
+InputSnapshot = namedtuple('InputSnapshot', 'pressed released held quit')
+
+
+class InputSource(ABC):
+    '''
+    Base class for anything that drives the game. Every frame, the main loop
+    polls its input source for an InputSnapshot and hands it to the active
+    context, so contexts don't need to know where their inputs come from.
+    Whatever the source, pygame's event queue is drained every frame and
+    closing the window is reported, every event type the game doesn't use
+    being blocked so that it never gets queued in the first place.
+    '''
+    EVENT_TYPES = [pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP]
+
+    def __init__(self):
+        '''
+        Create an InputSource. Not to be called before pygame display module
+        has been initialized.
+        '''
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(InputSource.EVENT_TYPES)
+
+    def poll(self):
+        '''
+        Return the InputSnapshot for this frame, to be called once per frame.
+        '''
+        events = pygame.event.get()
+        quit_requested = any(event.type == pygame.QUIT for event in events)
+        return self.keys(events)._replace(quit=quit_requested)
+
+    @abstractmethod
+    def keys(self, events):
+        '''
+        Every subclass needs to implement this. It returns the InputSnapshot
+        for this frame, quit aside, events being the events queued since last
+        frame which sources not reading the keyboard ignore.
+        '''
+        pass
+
+
+class KeyboardSource(InputSource):
+    '''
+    Input source reading the user's keyboard through pygame's event queue.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self._held = set()
+
+    def keys(self, events):
+        pressed, released = set(), set()
+        # held keys follow events in queue order, so that a key released and
+        # pressed again within a frame is still held
+        for event in events:
+            if event.type == pygame.KEYDOWN:
+                pressed.add(event.key)
+                self._held.add(event.key)
+            elif event.type == pygame.KEYUP:
+                released.add(event.key)
+                self._held.discard(event.key)
+        return InputSnapshot(frozenset(pressed), frozenset(released),
+                             frozenset(self._held), False)
+
+
+class BotSource(InputSource):
+    '''
+    Input source driven by a policy: a function that takes the frame number
+    and returns the keys to be held down during that frame. Pressed and
+    released keys are worked out from one frame to the next.
+    '''
+
+    def __init__(self, policy):
+        super().__init__()
+        self._policy = policy
+        self._frame = 0
+        self._held = frozenset()
+
+    def keys(self, events):
+        held = frozenset(self._policy(self._frame))
+        snapshot = InputSnapshot(held - self._held, self._held - held,
+                                 held, False)
+        self._frame += 1
+        self._held = held
+        return snapshot
+
+
+class ScriptedSource(BotSource):
+    '''
+    Input source playing a script: a sequence of sets of keys held down, one
+    for each frame. Once the script is over, no key is held.
+    '''
+
+    def __init__(self, script):
+        script = tuple(script)
+        super().__init__(lambda frame: script[frame] if frame < len(script) else ())
+
+
+class RecordingSource(InputSource):
+    '''
+    Input source wrapping another one and keeping every snapshot it produces
+    in its recording attribute, so that it can be played by a ReplaySource.
+    If a file is given, every snapshot is also written to it as a line of
+    JSON, as read by ReplaySource.load.
+    '''
+
+    def __init__(self, source, file=None):
+        super().__init__()
+        self._source = source
+        self._file = file
+        self.recording = []
+
+    def keys(self, events):
+        snapshot = self._source.keys(events)
+        self.recording.append(snapshot)
+        if self._file:
+            keys = [sorted(snapshot.pressed), sorted(snapshot.released),
+                    sorted(snapshot.held)]
+            self._file.write(json.dumps(keys) + '\n')
+            self._file.flush()
+        return snapshot
+
+
+class ReplaySource(InputSource):
+    '''
+    Input source replaying a recording, a sequence of InputSnapshot. Once the
+    recording is over, keys still held are released.
+    '''
+
+    def __init__(self, recording):
+        super().__init__()
+        self._snapshots = iter(recording)
+        self._held = frozenset()
+
+    def keys(self, events):
+        try:
+            snapshot = next(self._snapshots)
+        except StopIteration:
+            snapshot = InputSnapshot(frozenset(), self._held, frozenset(), False)
+        self._held = snapshot.held
+        return snapshot
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Create a ReplaySource for the recording written by a RecordingSource
+        in the file at path.
+        '''
+        recording = []
+        with open(path) as recording_file:
+            for line in recording_file:
+                pressed, released, held = json.loads(line)
+                recording.append(InputSnapshot(frozenset(pressed),
+                                               frozenset(released),
+                                               frozenset(held), False))
+        return cls(recording)
+
+
+def bot_policy(frame):
+    '''
+    Policy for a BotSource that starts a game from the main menu and then
+    keeps shooting arrows bent for two thirds of a second.
+    '''
+    cycle = frame % 45
+    if cycle == 0:
+        return {pygame.K_RETURN}
+    if cycle < 20:
+        return {pygame.K_SPACE}
+    return set()
+
+
+def option_value(option):
+    '''
+    Return the command line argument following option, None if option isn't
+    on the command line.
+    '''
+    if option in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(option) + 1]
+
+
+class FrameGovernor:
+    '''
+    Keep track of how long every frame takes compared to the time budget given
+    by the frame rate. Every frame over budget degrades the game one level
+    further, every level keeping the previous ones' degradations:
+        - SKIP_REDRAWS: non-essential redraws are skipped
+        - DEFER_TASKS: deferred tasks, such as cache fills and preloads, are
+                       put off until the game gets back under budget
+        - LOWER_RENDER_RATE: sprites are only drawn and the display only
+                             refreshed every RENDER_DIVISOR frames, the game
+                             logic still runs every frame
+    After RECOVER_FRAMES frames in a row under budget, the game goes back up
+    one level. Every level change is logged.
+    '''
+    NORMAL = 0
+    SKIP_REDRAWS = 1
+    DEFER_TASKS = 2
+    LOWER_RENDER_RATE = 3
+    LEVEL_NAMES = ['normal', 'skip redraws', 'defer tasks', 'lower render rate']
+    RENDER_DIVISOR = 2
+    RECOVER_FRAMES = 60
+    # deferred tasks only run during the first part of a frame's budget
+    SPARE_RATIO = 0.5
+
+    def __init__(self, fps):
+        '''
+        Create a FrameGovernor for a game running at fps frames per second.
+        '''
+        self._budget = 1 / fps
+        self._level = FrameGovernor.NORMAL
+        self._tasks = []
+        # time every task took last time it ran
+        self._task_times = {}
+        self._frame = 0
+        self._frame_start = time.perf_counter()
+        self._frames_under = 0
+        self.degradations = 0
+
+    def start_frame(self):
+        '''
+        To be called at the beginning of every frame.
+        '''
+        self._frame += 1
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        '''
+        To be called at the end of every frame, before waiting for the next
+        one. Change the level depending on how long the frame took.
+        '''
+        elapsed = time.perf_counter() - self._frame_start
+        if elapsed > self._budget:
+            self._frames_under = 0
+            if self._level < FrameGovernor.LOWER_RENDER_RATE:
+                self._level += 1
+                self.degradations += 1
+                LOGGER.warning('frame %d took %.1f ms over a %.1f ms budget, '
+                               'degrading to level %s (%d degradations so far)',
+                               self._frame, elapsed * 1000, self._budget * 1000,
+                               FrameGovernor.LEVEL_NAMES[self._level],
+                               self.degradations)
+        else:
+            self._frames_under += 1
+            if self._frames_under >= FrameGovernor.RECOVER_FRAMES and self._level:
+                self._frames_under = 0
+                self._level -= 1
+                LOGGER.info('frame %d, recovering to level %s',
+                            self._frame, FrameGovernor.LEVEL_NAMES[self._level])
+
+    def defer(self, task):
+        '''
+        Schedule task, a function taking no argument, to be run during a later
+        frame that has time to spare.
+        '''
+        self._tasks.append(task)
+
+    def run_deferred(self):
+        '''
+        Run deferred tasks as long as the current frame is under SPARE_RATIO
+        of its budget and what is left of the budget covers the time the next
+        task took last time it ran, unless the game is degraded to DEFER_TASKS
+        or further. To be called before end_frame so that the time tasks take
+        counts in the frame's.
+        '''
+        while self._tasks and self._level < FrameGovernor.DEFER_TASKS:
+            task = self._tasks[0]
+            elapsed = time.perf_counter() - self._frame_start
+            if elapsed > self._budget * FrameGovernor.SPARE_RATIO:
+                break
+            # a task longer than the whole budget would never run otherwise
+            task_time = min(self._task_times.get(task, 0),
+                            self._budget * (1 - FrameGovernor.SPARE_RATIO))
+            if elapsed + task_time > self._budget:
+                break
+            self._tasks.pop(0)
+            task()
+            self._task_times[task] = time.perf_counter() - self._frame_start - elapsed
+
+    def should_render(self):
+        '''
+        Return whether sprites need to be drawn and the display refreshed this
+        frame.
+        '''
+        if self._level < FrameGovernor.LOWER_RENDER_RATE:
+            return True
+        return self._frame % FrameGovernor.RENDER_DIVISOR == 0
+
+    @property
+    def level(self):
+        ''' level(self) -> self._level '''
+        return self._level
+
+
+class Screen(ABC):
+    '''
+    Base class for what contexts draw on. A Screen is used like the display
+    surface: surfaces are blitted onto it and what has been drawn stays there
+    from one frame to the next. present shows the current frame to the user
+    and every REPORT_FRAMES frames, the time frames and presents took is
+    logged.
+    '''
+    REPORT_FRAMES = 300
+
+    def __init__(self, name):
+        '''
+        Create a Screen, name being the name of the renderer it draws with.
+        '''
+        self.name = name
+        self._last_present = None
+        self._frame_total = 0
+        self._present_total = 0
+        self._frames = 0
+
+    @abstractmethod
+    def blit(self, source, dest, area=None, special_flags=0):
+        '''
+        Every subclass needs to implement this. It draws source, a Surface,
+        onscreen just like Surface.blit and returns the Rect drawn onto.
+        '''
+        pass
+
+    @abstractmethod
+    def blend(self, overlay):
+        '''
+        Every subclass needs to implement this. It returns what is currently
+        drawn onscreen with overlay, a translucent Surface, blended over it,
+        as something that can be blitted onto the Screen.
+        '''
+        pass
+
+    @abstractmethod
+    def flip(self):
+        '''
+        Every subclass needs to implement this. It shows what has been drawn
+        to the user.
+        '''
+        pass
+
+    def blits(self, blit_sequence, doreturn=True):
+        '''
+        Blit every (source, dest, area, special_flags) of blit_sequence, only
+        source and dest are mandatory, likewise Surface.blits.
+        '''
+        rects = [self.blit(*args) for args in blit_sequence]
+        if doreturn:
+            return rects
+
+    def invalidate(self, surface):
+        '''
+        To be called whenever a surface already blitted onscreen gets drawn
+        on, so that the Screen doesn't keep using an outdated copy of it.
+        '''
+        pass
+
+    def present(self):
+        '''
+        Show the current frame and keep track of the frame time.
+        '''
+        start = time.perf_counter()
+        self.flip()
+        now = time.perf_counter()
+        self._present_total += now - start
+        if self._last_present is not None:
+            self._frame_total += now - self._last_present
+            self._frames += 1
+        self._last_present = now
+        if self._frames == Screen.REPORT_FRAMES:
+            LOGGER.info('%s renderer: %.2f ms per frame, %.2f ms presenting',
+                        self.name,
+                        self._frame_total / self._frames * 1000,
+                        self._present_total / self._frames * 1000)
+            self._frame_total = self._present_total = 0
+            self._frames = 0
+
+
+class SoftwareScreen(Screen):
+    '''
+    Screen drawing straight onto the display surface.
+    '''
+    def __init__(self, surface):
+        super().__init__('software')
+        self._surface = surface
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        return self._surface.blit(source, dest, area, special_flags)
+
+    def blend(self, overlay):
+        blended = self._surface.copy()
+        blended.blit(overlay, (0, 0))
+        return blended
+
+    def flip(self):
+        pygame.display.flip()
+
+
+class RendererScreen(Screen):
+    '''
+    Screen drawing through an SDL renderer. Every surface is uploaded once as
+    a texture and drawn as a textured quad onto a target texture that keeps
+    what has been drawn between frames, that target texture being copied to
+    the window when presenting. Textures can be blitted too, special_flags
+    are not supported.
+    '''
+
+    def __init__(self, window, accelerated):
+        '''
+        Create a RendererScreen for window, a pygame._sdl2.video.Window that
+        has no display surface. If accelerated, the renderer has to be hardware
+        accelerated, otherwise SDL's software renderer is used. Raise one of
+        RENDERER_ERRORS if no such renderer is available.
+        '''
+        super().__init__('accelerated' if accelerated else 'SDL software')
+        self._renderer = video.Renderer(window,
+                                        accelerated=int(accelerated),
+                                        target_texture=True)
+        self._target = video.Texture(self._renderer, window.size, target=True)
+        self._renderer.target = self._target
+        self._textures = weakref.WeakKeyDictionary()
+
+    def texture(self, surface):
+        '''
+        Return the texture for surface, uploading it if needed.
+        '''
+        texture = self._textures.get(surface)
+        if texture is None:
+            texture = video.Texture.from_surface(self._renderer, surface)
+            self._textures[surface] = texture
+        return texture
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        source_rect = source.get_rect()
+        if area is not None:
+            source_rect = source_rect.clip(area)
+        if special_flags:
+            raise ValueError('special_flags are not supported by the renderer')
+        dest_rect = pygame.Rect(dest[0], dest[1], *source_rect.size)
+        if not isinstance(source, video.Texture):
+            source = self.texture(source)
+        source.draw(source_rect, dest_rect)
+        return dest_rect
+
+    def blend(self, overlay):
+        '''
+        Return a target texture holding the current frame with the overlay
+        texture drawn over it, everything staying on the graphics card.
+        '''
+        blended = video.Texture(self._renderer, self._target.get_rect().size,
+                                target=True)
+        self._renderer.target = blended
+        self._target.draw()
+        self.texture(overlay).draw()
+        self._renderer.target = self._target
+        return blended
+
+    def invalidate(self, surface):
+        self._textures.pop(surface, None)
+
+    def flip(self):
+        self._renderer.target = None
+        self._target.draw()
+        self._renderer.present()
+        self._renderer.target = self._target
+
+
+def create_screen(size, caption, icon, renderer=False):
+    '''
+    Open the game's window and return the Screen the game is drawn on. If
+    renderer, an accelerated renderer is used, falling back to SDL's software
+    renderer and then to the display surface when unavailable. Also initialize
+    PixelFormat for that Screen.
+    '''
+    if renderer and video:
+        # a renderer can't be created for a window that has a display surface
+        window = video.Window(caption, size)
+        window.set_icon(icon)
+        for accelerated in True, False:
+            try:
+                screen = RendererScreen(window, accelerated)
+            except RENDERER_ERRORS as error:
+                LOGGER.warning('no %s renderer: %s',
+                               'accelerated' if accelerated else 'software',
+                               error)
+            else:
+                # textures are made out of any format, pick a common one
+                PixelFormat.init(pygame.Surface((1, 1), depth=32))
+                return screen
+        window.destroy()
+    elif renderer:
+        LOGGER.warning('this version of pygame has no renderer')
+    pygame.display.set_icon(icon)
+    surface = pygame.display.set_mode(size)
+    pygame.display.set_caption(caption)
+    PixelFormat.init(surface)
+    return SoftwareScreen(surface)
+
+
+class PixelFormat:
+    '''
+    Pixel formats every picture is converted to before being drawn onscreen,
+    so that they don't depend on the display surface, which the renderer
+    screens don't have.
+    '''
+    # to be initialized
+    OPAQUE = None
+    TRANSLUCENT = None
+
+    @classmethod
+    def convert(cls, surface, translucent=False):
+        '''
+        Return a copy of surface in the opaque pixel format, or in the format
+        with per-pixel alpha if translucent.
+        '''
+        if translucent:
+            return surface.convert(cls.TRANSLUCENT)
+        return surface.convert(cls.OPAQUE)
+
+    @classmethod
+    def init(cls, surface):
+        '''
+        Initialize the pixel formats, surface being a surface in the opaque
+        pixel format. Not to be called before pygame display module has been
+        initialized.
+        '''
+        cls.OPAQUE = surface
+        cls.TRANSLUCENT = pygame.Surface((1, 1), flags=pygame.SRCALPHA, depth=32)
+
+
 # QuitContext looks like a Context but just exit the game
 DummyContext = namedtuple('DummyContext', 'update')
 def quit_func(*args):
@@ -688,6 +1419,82 @@ def iddle_sprite(img, pos, background):
     '''
     background.blit(img, pos)
 
+def blit_format(surface, translucent=False):
+    '''
+    Return a copy of surface in the PixelFormat that is the fastest to blit:
+        - translucent surfaces keep their per-pixel alpha
+        - any other surface is made opaque, its pixel (0, 0) color being used
+          as a run-length encoded colorkey
+    Not to be called before PixelFormat has been initialized.
+    '''
+    if translucent:
+        return PixelFormat.convert(surface, translucent=True)
+    colorkey = surface.get_at((0, 0))
+    surface = PixelFormat.convert(surface)
+    surface.set_colorkey(colorkey, pygame.RLEACCEL)
+    return surface
+
+def benchmark_blits(screen, blits=2000):
+    '''
+    Print the average cost of a single blit onto screen for each of the
+    surface formats the game may use.
+    '''
+    arrow = pygame.image.load('resources/arrow2.png')
+    colorkey = arrow.get_at((0, 0))
+    plain_key = arrow.convert()
+    plain_key.set_colorkey(colorkey)
+    overlay = pygame.Surface(screen.get_size(), flags=pygame.SRCALPHA)
+    overlay.fill(CustomMenu.COLOR_DEFAULT)
+    pre_blended = screen.copy()
+    pre_blended.blit(overlay, (0, 0))
+    candidates = [
+        ('sprite, unconverted', arrow),
+        ('sprite, colorkey', plain_key),
+        ('sprite, RLE colorkey', blit_format(arrow)),
+        ('sprite, per-pixel alpha', blit_format(arrow, translucent=True)),
+        ('pause overlay, per-pixel alpha', overlay.convert_alpha()),
+        ('pause overlay, pre-blended', pre_blended),
+    ]
+    print('display format: {} bits per pixel'.format(screen.get_bitsize()))
+    for name, surface in candidates:
+        start = time.perf_counter()
+        for i in range(blits):
+            screen.blit(surface, (0, 0))
+        elapsed = time.perf_counter() - start
+        print('{:>32}: {:8.2f} us per blit'.format(name, elapsed / blits * 1e6))
+
+def swept_collide(rect, motion, rects):
+    '''
+    Move rect by motion, without actually changing it, and return a tuple
+    (index, fraction) for the first rect of rects that gets hit on the way:
+        - index is the index of that rect in rects, -1 if none is hit
+        - fraction is how far along motion the hit happens, between 0 and 1,
+          None if none is hit
+    Rects hit at the same fraction are ordered as in rects, like collidelist.
+    '''
+    dx, dy = motion
+    first_index, first_fraction = -1, None
+    for index, other in enumerate(rects):
+        # rect collides with other as long as its topleft corner is strictly
+        # inside other grown by rect's size
+        t_enter, t_exit = 0, 1
+        for start, delta, low, high in ((rect.x, dx, other.x - rect.width, other.right),
+                                        (rect.y, dy, other.y - rect.height, other.bottom)):
+            if delta == 0:
+                if not low < start < high:
+                    t_enter, t_exit = 1, 0
+                    break
+            else:
+                t_low = (low - start) / delta
+                t_high = (high - start) / delta
+                if t_low > t_high:
+                    t_low, t_high = t_high, t_low
+                t_enter = max(t_enter, t_low)
+                t_exit = min(t_exit, t_high)
+        if t_enter < t_exit and (first_fraction is None or t_enter < first_fraction):
+            first_index, first_fraction = index, t_enter
+    return first_index, first_fraction
+
 def darken_color(base_color, current_color, counter):
     '''
     Randomly return a darken color or the base_color depending on counter,
@@ -731,7 +1538,7 @@ def draw_background(size, sky_stripes=1):
             px_array[i, j] = current_color
     background = pygame.transform.scale(background, (SCREEN_WIDTH, SCREEN_HEIGHT))
     # convert to screen pixel format
-    background = background.convert()
+    background = PixelFormat.convert(background)
     return background
 
 def context_change(context_dict, instruction):
@@ -751,19 +1558,32 @@ if __name__ == '__main__':
     # pygame init
     pygame.init()
     icon = pygame.image.load('resources/icon.png')
-    pygame.display.set_icon(icon)
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-    pygame.display.set_caption('Archery')
+    size = SCREEN_WIDTH, SCREEN_HEIGHT
     clock = pygame.time.Clock()
     fps = 30
-
-    # Bow and Arrow init
-    Bow.init(fps)
+    logging.basicConfig(format='%(asctime)s %(name)s: %(message)s',
+                        level=logging.INFO)
+    governor = FrameGovernor(fps)
+
+    # compare blit costs of the different surface formats and leave
+    if '--benchmark' in sys.argv:
+        create_screen(size, 'Archery', icon)
+        benchmark_blits(pygame.display.get_surface())
+        pygame.quit()
+        sys.exit()
+
+    # draw through an SDL renderer if asked to
+    screen = create_screen(size, 'Archery', icon,
+                           renderer='--renderer' in sys.argv)
+    LOGGER.info('using the %s renderer', screen.name)
+
+    # Arrow and Bow init
     Arrow.init()
+    Bow.init(fps)
     Target.init()
     # Contexts initialization
-    GameContext.init(screen)
-    CustomMenu.init(screen)
+    GameContext.init(screen, governor)
+    CustomMenu.init(screen, governor)
     # Contexts instanciation
     ContextEntry = namedtuple('ContextEntry', 'cont_class instance')
     menu_entry = ContextEntry(CustomMenu.MainMenu, CustomMenu.MainMenu())
@@ -778,20 +1598,29 @@ if __name__ == '__main__':
         'Quit': quit_entry
     }
     active_context = context_dict['Menu'].instance
+    # inputs come from the keyboard unless a bot or a replay is asked for
+    if '--bot' in sys.argv:
+        input_source = BotSource(bot_policy)
+    elif option_value('--replay'):
+        input_source = ReplaySource.load(option_value('--replay'))
+    else:
+        input_source = KeyboardSource()
+    if option_value('--record'):
+        input_source = RecordingSource(input_source,
+                                       open(option_value('--record'), 'w'))
 
     while True:
 
-        # dump all previous inputs and grab relevant ones
-        inputs = []
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                active_context = context_change(context_dict, 'Quit Switch')
-            elif event.type == pygame.KEYDOWN:
-                inputs.append(event)
-            elif event.type == pygame.KEYUP:
-                inputs.append(event)
+        governor.start_frame()
+        # grab this frame's inputs
+        inputs = input_source.poll()
+        if inputs.quit:
+            active_context = context_change(context_dict, 'Quit Switch')
         context_instruction = active_context.update(inputs)
         if context_instruction:
             active_context = context_change(context_dict, context_instruction)
-        pygame.display.flip()
+        if governor.should_render():
+            screen.present()
+        governor.run_deferred()
+        governor.end_frame()
         clock.tick(fps)